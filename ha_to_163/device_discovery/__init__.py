@@ -1,3 +1,3 @@
 # 导出设备发现类，便于主程序导入
-from .ha_discovery import HADiscovery
+from .ha_discovery import HADiscovery, MatchedDevice, build_ha_session
     
\ No newline at end of file
@@ -1,12 +1,27 @@
 import requests
 import re
+import sys
 import logging
-import time
-from typing import Dict
+import json
+import hashlib
+import functools
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from .base_discovery import BaseDiscovery
 
+# orjson为可选加速依赖，未安装时回退到标准库json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # 保留完整的环境传感器映射
-PROPERTY_MAPPING = {
+# 只读：下方的预编译正则、键集合及属性解析缓存均由其派生，运行时修改会导致它们失效
+PROPERTY_MAPPING = MappingProxyType({
     # 环境传感器核心映射
     "temperature": "temp",
     "temp": "temp",
@@ -45,217 +60,501 @@ PROPERTY_MAPPING = {
     "electric_current": "current",
     "voltage": "voltage",
     "frequency": "frequency"
+})
+
+
+@dataclass(slots=True)
+class MatchedDevice:
+    """子设备的匹配记录：配置、已匹配的属性→实体ID，以及匹配时预先计算的字段"""
+    config: Dict
+    cleaned_prefix: str  # 修正后的前缀（环境传感器不含"sensor."）
+    supported: frozenset  # 支持的属性集合
+    environment: bool  # 是否为环境传感器（预先划分设备类别，匹配时无需再查设备类型）
+    electric: bool  # 是否为电气设备（开关/插座/断路器）
+    entities: Dict[str, str] = field(default_factory=dict)
+
+
+# 单个实体的匹配上下文：(entity_id, 实体类型, 实体核心, device_class小写, friendly_name小写)
+EntityContext = Tuple[str, str, str, str, str]
+# 候选设备：(device_id, device_data) 元组序列
+DeviceItems = Tuple[Tuple[str, MatchedDevice], ...]
+
+# HA实际会上报的device_class取值 → 属性，device_class匹配只查这张小表
+_DC_MAP = {
+    k: PROPERTY_MAPPING[k]
+    for k in ("temperature", "humidity", "battery", "door", "power", "energy", "current", "voltage", "frequency")
+    if k in PROPERTY_MAPPING
 }
 
+# 映射键集合，用于实体ID拆分部分的快速成员判断
+_MAPPING_KEYS = frozenset(PROPERTY_MAPPING)
+
+# friendly_name关键字匹配：名称中出现的映射键里取在PROPERTY_MAPPING中排在最前的一个（与逐键判断子串的顺序一致）
+# 零宽前瞻使每个位置都参与匹配，避免短键（如"on"、"door"）所在的较早位置遮蔽其他键
+_FN_KEY_RANK = {key: rank for rank, key in enumerate(PROPERTY_MAPPING)}
+_FN_REGEX = re.compile("(?=(" + "|".join(map(re.escape, PROPERTY_MAPPING)) + "))")
+
+# 实体ID末尾的"_p"参数后缀（如"_p_3_2"）
+_P_SUFFIX_RE = re.compile(r'_p[_\d]+$')
+
+
+# 纯函数：结果只取决于入参字符串；HA中大量实体共享相同后缀/名称，缓存命中可跳过全部匹配维度（限制容量避免无界增长）
+@functools.lru_cache(maxsize=4096)
+def _resolve_property(suffix: str, device_class: str = "", friendly_name: str = "",
+                      electric: bool = False) -> Optional[str]:
+    """按匹配维度依次解析实体对应的属性名（环境传感器与电气设备共用），无法解析时返回None
+
+    环境传感器：device_class → 实体ID各部分 → 完整后缀 → friendly_name关键字
+    电气设备：组合关键字 → 完整后缀 → 实体ID各部分
+    """
+    if electric:
+        # 组合关键字按优先级依次判断（两者同时出现时以electric_power为准，与出现位置无关）
+        if "electric_power" in suffix:
+            return PROPERTY_MAPPING["electric_power"]
+        if "power_consumption" in suffix:
+            return PROPERTY_MAPPING["power_consumption"]
+        if suffix in PROPERTY_MAPPING:
+            return PROPERTY_MAPPING[suffix]
+        part = next((p for p in suffix.split('_') if p in _MAPPING_KEYS), None)
+        return PROPERTY_MAPPING[part] if part else None
+
+    # 1. device_class匹配（最高优先级）
+    if device_class in _DC_MAP:
+        return _DC_MAP[device_class]
+    # 2. 实体ID部分匹配（支持带_p后缀），其次完整匹配
+    part = next((p for p in suffix.split('_') if p in _MAPPING_KEYS), None)
+    if part:
+        return PROPERTY_MAPPING[part]
+    if suffix in PROPERTY_MAPPING:
+        return PROPERTY_MAPPING[suffix]
+    # 3. friendly_name匹配
+    keys = {match.group(1) for match in _FN_REGEX.finditer(friendly_name)}
+    return PROPERTY_MAPPING[min(keys, key=_FN_KEY_RANK.__getitem__)] if keys else None
+
+
+# 通过/api/template只渲染前缀匹配的sensor/switch实体（仅保留匹配所需字段），__PATTERN__为实体ID正则
+_STATES_TEMPLATE = (
+    "{%- set ns = namespace(items=[]) -%}"
+    "{%- for s in states if s.entity_id is search(__PATTERN__) -%}"
+    "{%- set ns.items = ns.items + [{'entity_id': s.entity_id, 'attributes': {"
+    "'device_class': s.attributes.get('device_class', ''), "
+    "'friendly_name': s.attributes.get('friendly_name', '')}}] -%}"
+    "{%- endfor -%}"
+    "{{ ns.items | tojson }}"
+)
+
+
+def _entities_fingerprint(entities) -> bytes:
+    """按顺序（已按entity_id排序）对匹配所依赖的字段（entity_id、device_class、friendly_name）计算摘要，实体状态值变化不影响摘要"""
+    digest = hashlib.blake2b(digest_size=8)
+    for entity in entities:
+        attributes = entity.get("attributes") or {}
+        digest.update((
+            f"{entity.get('entity_id', '')}\x1f{attributes.get('device_class') or ''}\x1f"
+            f"{attributes.get('friendly_name') or ''}\x1e"
+        ).encode())
+    return digest.digest()
+
+
+def build_ha_session(config: Dict, ha_headers: Dict, retries: bool = True) -> requests.Session:
+    """创建访问HA的HTTP会话（keep-alive连接池，携带认证头）
+
+    retries为False时不做任何重试：失败立即抛出，由调用方按自己的节奏轮询（如就绪探测、逐实体读取）。
+    """
+    session = requests.Session()
+    session.headers.update(ha_headers)
+    # 由连接池适配器负责重试（遵循Retry-After），替代手动重试循环
+    # 退避时长为backoff_factor*2^(n-1)：取retry_delay/2并以retry_delay封顶，即每次重试间隔固定为retry_delay秒（首次重试立即进行）
+    retry_delay = config.get("retry_delay", 3)
+    retry = Retry(
+        total=config.get("retry_attempts", 5),
+        backoff_factor=retry_delay / 2,
+        backoff_max=retry_delay,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=("GET", "POST"),
+        respect_retry_after_header=True
+    ) if retries else 0
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 class HADiscovery(BaseDiscovery):
-    def __init__(self, config, ha_headers):
+    def __init__(self, config, ha_headers, session: Optional[requests.Session] = None):
         super().__init__(config, "ha_discovery")
         self.ha_url = config.get("ha_url")
         self.ha_headers = ha_headers
         self.entities = []
+        # 复用HTTP会话（keep-alive，可由调用方传入共享），并记录上次响应的缓存校验信息用于条件请求
+        self._session = session if session is not None else build_ha_session(config, ha_headers)
+        self._etag = None
+        self._last_modified = None
+        self._cached_entities = None
+        self._cached_entities_key = None
         self.sub_devices = [d for d in config.get("sub_devices", []) if d.get("enabled", True)]
         self.electric_device_types = {"switch", "socket", "breaker"}
         self.environment_types = {"sensor"}
+        self._entity_matchers = self._build_entity_matchers()
+        # 匹配结果缓存：子设备配置在实例内固定，实体的匹配字段未变化时直接复用上次的匹配结果
+        self._entities_key = None
+        self._last_entities_key = None
+        self._last_matched = None
+        self._debug_enabled = False
+        # 首次全量获取成功后，改用/api/template只拉取前缀匹配的实体
+        entity_pattern = self._build_entity_pattern()
+        self._relevant_entity_re = re.compile(entity_pattern) if entity_pattern else None
+        self._states_template = (
+            _STATES_TEMPLATE.replace("__PATTERN__", json.dumps(entity_pattern)) if entity_pattern else None
+        )
+        self._template_ready = False
+
+    def _build_entity_matchers(self) -> Dict[str, tuple]:
+        """按实体类型分派匹配器（按顺序尝试，先命中者生效）：sensor先匹配环境传感器再匹配电气设备，switch只匹配电气设备
+
+        只登记已配置设备类别所需的匹配器；没有任何匹配器的实体类型（如未配置电气设备时的switch）在加载时即被过滤。
+        """
+        has_environment = any(d["type"] in self.environment_types for d in self.sub_devices)
+        has_electric = any(d["type"] in self.electric_device_types for d in self.sub_devices)
+        sensor_matchers = (
+            ((self._match_environment_sensor,) if has_environment else ())
+            + ((self._match_electric_device,) if has_electric else ())
+        )
+        matchers = {}
+        if sensor_matchers:
+            matchers["sensor"] = sensor_matchers
+        if has_electric:
+            matchers["switch"] = (self._match_electric_device,)
+        return matchers
+
+    def _cleaned_prefix(self, device: Dict) -> str:
+        """环境传感器的前缀去掉"sensor."（仅保留设备标识部分）"""
+        ha_prefix = device["ha_entity_prefix"]
+        if device["type"] in self.environment_types and ha_prefix.startswith("sensor."):
+            return ha_prefix[len("sensor."):]  # 如"sensor.hz2_01_" → "hz2_01_"
+        return ha_prefix
+
+    def _build_entity_pattern(self) -> Optional[str]:
+        """构建匹配相关实体ID（有匹配器的实体类型且核心以任一设备前缀开头）的正则，无可匹配设备时返回None"""
+        if not self._entity_matchers:
+            return None
+        domains = "|".join(sorted(self._entity_matchers))
+        prefixes = sorted({re.escape(self._cleaned_prefix(d)) for d in self.sub_devices})
+        return r"^(?:" + domains + r")\.(?:" + "|".join(prefixes) + ")"
+
+    def _load_entities_via_template(self) -> bool:
+        """通过/api/template批量获取前缀匹配的实体，失败时返回False以回退全量获取"""
+        try:
+            resp = self._session.post(
+                f"{self.ha_url}/api/template",
+                json={"template": self._states_template},
+                timeout=10
+            )
+            if resp.status_code != 200:
+                self.logger.warning(f"模板获取实体失败，状态码: {resp.status_code}，回退到/api/states")
+                return False
+            entities = _json_loads(resp.content)
+        except Exception as e:
+            self.logger.warning(f"模板获取实体失败: {e}，回退到/api/states")
+            return False
+
+        self._set_entities(entities)
+        self.logger.info(f"通过模板获取到 {len(self.entities)} 个前缀匹配实体")
+        return True
+
+    def _set_entities(self, entities: list):
+        """保存获取到的实体并计算其摘要
+
+        匹配按"先到先得"进行，结果依赖实体顺序；模板与/api/states返回的顺序并无保证一致，
+        因此统一按entity_id排序，使两种获取方式得到相同的匹配结果与缓存键。
+        """
+        entities.sort(key=lambda entity: entity["entity_id"])
+        self.entities = entities
+        self._entities_key = _entities_fingerprint(entities)
+
+    def _compact_entities(self, entities) -> Tuple[list, int]:
+        """只保留前缀相关的sensor/switch实体及匹配所需字段（与模板获取的结构一致），返回(精简列表, 实体总数)"""
+        # 用一个预编译正则（C层扫描）批量剔除不可能匹配任何设备的实体
+        relevant_search = self._relevant_entity_re.search if self._relevant_entity_re else None
+        compact = []
+        total = 0
+        for entity in entities:
+            total += 1
+            entity_id = entity.get("entity_id", "")
+            if relevant_search is None or not relevant_search(entity_id):
+                continue
+            attributes = entity.get("attributes") or {}
+            compact.append({
+                "entity_id": entity_id,
+                "attributes": {
+                    "device_class": attributes.get("device_class") or "",
+                    "friendly_name": attributes.get("friendly_name") or ""
+                }
+            })
+        return compact, total
 
     def load_ha_entities(self) -> bool:
         try:
+            if self._template_ready and self._states_template and self._load_entities_via_template():
+                return True
+
             self.logger.info(f"从HA获取实体列表: {self.ha_url}/api/states")
-            resp = None
-            retry_attempts = self.config.get("retry_attempts", 5)
-            retry_delay = self.config.get("retry_delay", 3)
-
-            for attempt in range(retry_attempts):
-                try:
-                    resp = requests.get(
-                        f"{self.ha_url}/api/states",
-                        headers=self.ha_headers,
-                        timeout=10
-                    )
-                    resp.raise_for_status()
-                    break
-                except Exception as e:
-                    self.logger.warning(f"获取HA实体尝试 {attempt + 1}/{retry_attempts} 失败: {e}")
-                    if attempt < retry_attempts - 1:
-                        time.sleep(retry_delay)
-
-            if not resp or resp.status_code != 200:
-                self.logger.error(f"HA实体获取失败，状态码: {resp.status_code if resp else '无响应'}")
+
+            # 条件请求：HA实体列表未变化时返回304，直接复用上次结果
+            headers = {}
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+
+            try:
+                resp = self._session.get(
+                    f"{self.ha_url}/api/states",
+                    headers=headers,
+                    timeout=10
+                )
+            except requests.RequestException as e:
+                self.logger.error(f"获取HA实体失败（重试后仍失败）: {e}")
                 return False
 
-            self.entities = resp.json()
-            self.logger.info(f"HA共返回 {len(self.entities)} 个实体")
+            if resp.status_code == 304 and self._cached_entities is not None:
+                self.entities = self._cached_entities
+                self._entities_key = self._cached_entities_key
+                self.logger.info(f"HA实体列表未变化（304），复用缓存的 {len(self.entities)} 个实体")
+                return True
+
+            if resp.status_code != 200:
+                self.logger.error(f"HA实体获取失败，状态码: {resp.status_code}")
+                return False
+
+            # 解析后立即精简，只保留前缀相关实体及匹配所需字段
+            entities, total = self._compact_entities(_json_loads(resp.content))
+
+            self._set_entities(entities)
+            self._cached_entities = self.entities
+            self._etag = resp.headers.get("ETag")
+            self._last_modified = resp.headers.get("Last-Modified")
+            self._cached_entities_key = self._entities_key
+            self._template_ready = True
+            self.logger.info(f"HA共返回 {total} 个实体，其中前缀相关实体 {len(self.entities)} 个")
             
-            # 重点日志：输出所有含"hz2_01"或"hz2_02"的传感器实体（环境传感器候选）
-            hz2_entities = [
-                e.get('entity_id') for e in self.entities 
-                if e.get('entity_id', '').startswith('sensor.') and 
-                ('hz2_01' in e.get('entity_id') or 'hz2_02' in e.get('entity_id'))
-            ]
-            self.logger.debug(f"环境传感器候选实体（含hz2_01/hz2_02）: {hz2_entities}")
+            # 重点日志：输出所有含"hz2_01"或"hz2_02"的传感器实体（环境传感器候选），仅DEBUG级别时才遍历
+            if self.logger.isEnabledFor(logging.DEBUG):
+                hz2_entities = [
+                    e.get('entity_id') for e in self.entities 
+                    if e.get('entity_id', '').startswith('sensor.') and 
+                    ('hz2_01' in e.get('entity_id') or 'hz2_02' in e.get('entity_id'))
+                ]
+                self.logger.debug("环境传感器候选实体（含hz2_01/hz2_02）: %s", hz2_entities)
             return True
         except Exception as e:
             self.logger.error(f"加载HA实体失败: {e}")
             return False
 
-    def match_entities_to_devices(self) -> Dict:
+    def _entity_columns(self) -> Tuple[list, list, list, list, list]:
+        """一次遍历把实体拆成并列的字段列表（entity_id、类型、核心、device_class小写、friendly_name小写）
+
+        只保留有匹配器的实体类型（sensor/switch）；按位置zip即得到EntityContext，匹配循环中无需再访问嵌套字典。
+        """
+        entity_ids, entity_types, entity_cores, device_classes, friendly_names = [], [], [], [], []
+        entity_matchers = self._entity_matchers  # 有匹配器的实体类型（sensor/switch）
+        for entity in self.entities:
+            entity_id = entity.get("entity_id", "")
+            entity_type, sep, entity_core = entity_id.partition('.')
+            if not sep or entity_type not in entity_matchers:
+                continue
+            # 属性只取一次；缺失或为null时视为空串，空串无需小写化
+            attributes = entity.get("attributes") or {}
+            device_class = attributes.get("device_class")
+            friendly_name = attributes.get("friendly_name")
+            entity_ids.append(entity_id)
+            entity_types.append(entity_type)
+            entity_cores.append(entity_core)
+            # HA上报的device_class通常已是小写，此时无需再生成新字符串
+            if not device_class:
+                device_class = ""
+            elif not device_class.islower():
+                device_class = device_class.lower()
+            device_classes.append(device_class)
+            friendly_names.append(friendly_name.lower() if friendly_name else "")
+        return entity_ids, entity_types, entity_cores, device_classes, friendly_names
+
+    def match_entities_to_devices(self) -> Dict[str, MatchedDevice]:
         matched_devices = {}
+        # 热循环中的调试日志只在DEBUG级别开启时才构造
+        self._debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
 
         for device in self.sub_devices:
             device_id = device["id"]
             device_type = device["type"]
             # 修正：环境传感器的前缀去掉"sensor."（仅保留设备标识部分）
             ha_prefix = device["ha_entity_prefix"]
-            if device_type in self.environment_types and ha_prefix.startswith("sensor."):
-                cleaned_prefix = ha_prefix[len("sensor."):]  # 如"sensor.hz2_01_" → "hz2_01_"
-                self.logger.debug(f"环境传感器 {device_id} 前缀修正: {ha_prefix} → {cleaned_prefix}")
-            else:
-                cleaned_prefix = ha_prefix
-            matched_devices[device_id] = {
-                "config": device,
-                "entities": {},
-                "cleaned_prefix": cleaned_prefix  # 存储修正后的前缀用于匹配
-            }
+            cleaned_prefix = self._cleaned_prefix(device)
+            if cleaned_prefix != ha_prefix:
+                self.logger.debug("环境传感器 %s 前缀修正: %s → %s", device_id, ha_prefix, cleaned_prefix)
+            matched_devices[device_id] = MatchedDevice(
+                config=device,
+                cleaned_prefix=cleaned_prefix,  # 存储修正后的前缀用于匹配
+                # 属性名驻留：与PROPERTY_MAPPING中的字面量为同一对象，成员判断按身份命中
+                supported=frozenset(map(sys.intern, device["supported_properties"])),
+                environment=device_type in self.environment_types,
+                electric=device_type in self.electric_device_types
+            )
             self.logger.info(f"开始匹配{device_type}设备: {device_id}（修正后前缀: {cleaned_prefix}）")
 
-        for entity in self.entities:
-            entity_id = entity.get("entity_id", "")
-            attributes = entity.get("attributes", {})
-            device_class = attributes.get("device_class", "").lower()
-            friendly_name = attributes.get("friendly_name", "").lower()
+        # 候选设备固化为元组供匹配器直接遍历（无支持属性的设备不可能匹配，预先剔除）
+        # 已匹配完成的设备仍保留在候选中：按配置顺序先命中前缀且支持该属性的设备始终"占用"该实体，
+        # 后续前缀重叠的设备不会因前者已完成而改为接收它
+        # 前缀可相互重叠（含空前缀），须按配置顺序检查全部前缀命中的设备，因此不用按前缀排序二分/索引（只能选出单个设备）
+        candidate_items = tuple(
+            (device_id, device_data) for device_id, device_data in matched_devices.items()
+            if device_data.supported
+        )
+        # 尚未匹配全部支持属性的设备数；全部完成后提前结束实体遍历
+        pending_count = len(candidate_items)
 
-            # 环境传感器处理
-            if entity_id.startswith("sensor."):
-                self._match_environment_sensor(entity_id, device_class, friendly_name, matched_devices)
-            
-            # 电气设备处理
-            if entity_id.startswith(("sensor.", "switch.")):
-                self._match_electric_device(entity_id, device_class, friendly_name, matched_devices)
+        for entity_ctx in zip(*self._entity_columns()):
+            if not pending_count:
+                self.logger.debug("所有设备的支持属性均已匹配，提前结束实体遍历")
+                break
+
+            # 按配置顺序依次尝试各设备
+            matched_id = self._match_entity(entity_ctx, candidate_items)
+            if matched_id is not None:
+                device_data = matched_devices[matched_id]
+                if len(device_data.entities) >= len(device_data.supported):
+                    pending_count -= 1
 
         # 输出匹配结果
         for device_id, device_data in matched_devices.items():
-            device_type = device_data["config"]["type"]
+            device_type = device_data.config["type"]
             if device_type in self.environment_types:
-                temp_status = "已匹配" if "temp" in device_data["entities"] else "未匹配"
-                hum_status = "已匹配" if "hum" in device_data["entities"] else "未匹配"
-                batt_status = "已匹配" if "batt" in device_data["entities"] else "未匹配"
+                temp_status = "已匹配" if "temp" in device_data.entities else "未匹配"
+                hum_status = "已匹配" if "hum" in device_data.entities else "未匹配"
+                batt_status = "已匹配" if "batt" in device_data.entities else "未匹配"
                 self.logger.info(
                     f"环境传感器 {device_id} 状态: "
                     f"temp={temp_status}, hum={hum_status}, batt={batt_status} → "
-                    f"匹配实体: {device_data['entities']}（使用前缀: {device_data['cleaned_prefix']}）"
+                    f"匹配实体: {device_data.entities}（使用前缀: {device_data.cleaned_prefix}）"
                 )
             else:
-                active_power_status = "已匹配" if "active_power" in device_data["entities"] else "未匹配"
-                energy_status = "已匹配" if "energy" in device_data["entities"] else "未匹配"
+                active_power_status = "已匹配" if "active_power" in device_data.entities else "未匹配"
+                energy_status = "已匹配" if "energy" in device_data.entities else "未匹配"
                 self.logger.info(
                     f"电气设备 {device_id} 状态: "
                     f"active_power={active_power_status}, energy={energy_status} → "
-                    f"匹配实体: {device_data['entities']}"
+                    f"匹配实体: {device_data.entities}"
                 )
 
         return matched_devices
 
-    def _match_environment_sensor(self, entity_id, device_class, friendly_name, matched_devices):
-        entity_core = entity_id.split('.', 1)[1]  # 如"sensor.hz2_01_temperature_p_2_1" → "hz2_01_temperature_p_2_1"
-        self.logger.debug(f"处理环境传感器实体: {entity_id}（核心: {entity_core}, device_class: {device_class}）")
+    def _match_entity(self, entity_ctx: EntityContext, candidates: DeviceItems) -> Optional[str]:
+        """匹配单个实体，返回新增属性的设备ID；已被环境传感器匹配的实体不再参与电气设备匹配"""
+        for matcher in self._entity_matchers.get(entity_ctx[1], ()):
+            device_id = matcher(entity_ctx, candidates)
+            if device_id is not None:
+                return device_id
+        return None
 
-        for device_id, device_data in matched_devices.items():
-            device = device_data["config"]
-            if device["type"] not in self.environment_types:
+    def _match_environment_sensor(self, entity_ctx: EntityContext, candidates: DeviceItems) -> Optional[str]:
+        """匹配环境传感器实体，返回新增了属性的设备ID（无新增返回None）"""
+        # 实体核心如"sensor.hz2_01_temperature_p_2_1" → "hz2_01_temperature_p_2_1"
+        entity_id, _, entity_core, device_class, friendly_name = entity_ctx
+        if self._debug_enabled:
+            self.logger.debug("处理环境传感器实体: %s（核心: %s, device_class: %s）", entity_id, entity_core, device_class)
+
+        # device_class只取决于实体本身（最高优先级），在设备循环外查一次
+        class_property = _DC_MAP.get(device_class)
+
+        for device_id, device_data in candidates:
+            if not device_data.environment:
                 continue
             
             # 使用修正后的前缀（不含"sensor."）进行匹配
-            prefix = device_data["cleaned_prefix"]
-            if prefix not in entity_core:
-                self.logger.debug(f"前缀不匹配: 实体核心={entity_core}，设备前缀={prefix}（跳过）")
+            prefix = device_data.cleaned_prefix
+            if not entity_core.startswith(prefix):
+                if self._debug_enabled:
+                    self.logger.debug("前缀不匹配: 实体核心=%s，设备前缀=%s（跳过）", entity_core, prefix)
                 continue
 
-            # 提取实体类型部分（如"hz2_01_temperature_p_2_1" → "temperature_p_2_1"）
-            entity_type_parts = entity_core.replace(prefix, "").strip('_').split('_')
-            entity_type = '_'.join(entity_type_parts)
-            if not entity_type:
+            # 提取前缀之后的实体类型部分（如"hz2_01_temperature_p_2_1" → "temperature_p_2_1"）
+            entity_tail = entity_core[len(prefix):].strip('_')
+            if not entity_tail:
                 continue
 
-            # 多维度匹配（恢复老代码逻辑）
-            property_name = None
-
-            # 1. device_class匹配（最高优先级）
-            if device_class in PROPERTY_MAPPING:
-                property_name = PROPERTY_MAPPING[device_class]
-                self.logger.debug(f"环境传感器 {device_id}: device_class={device_class} → {property_name}")
-            
-            # 2. 实体ID部分匹配（支持带_p后缀）
-            if not property_name:
-                for part in entity_type_parts:
-                    if part in PROPERTY_MAPPING:
-                        property_name = PROPERTY_MAPPING[part]
-                        self.logger.debug(f"环境传感器 {device_id}: 实体部分={part} → {property_name}")
-                        break
-                if not property_name and entity_type in PROPERTY_MAPPING:
-                    property_name = PROPERTY_MAPPING[entity_type]
-                    self.logger.debug(f"环境传感器 {device_id}: 实体完整={entity_type} → {property_name}")
-            
-            # 3. friendly_name匹配
-            if not property_name:
-                for key in PROPERTY_MAPPING:
-                    if key in friendly_name:
-                        property_name = PROPERTY_MAPPING[key]
-                        self.logger.debug(f"环境传感器 {device_id}: 名称包含={key} → {property_name}")
-                        break
+            property_name = class_property or _resolve_property(entity_tail, device_class, friendly_name)
+            if self._debug_enabled:
+                self.logger.debug("环境传感器 %s: %s → %s", device_id, entity_tail, property_name)
 
             # 验证并添加匹配
-            if property_name and property_name in device["supported_properties"]:
-                if property_name not in device_data["entities"]:
-                    device_data["entities"][property_name] = entity_id
+            if property_name and property_name in device_data.supported:
+                if device_data.entities.setdefault(property_name, entity_id) is entity_id:
                     self.logger.info(f"环境传感器匹配成功: {entity_id} → {property_name}（设备: {device_id}）")
-                break
+                    return device_id
+                return None
+        return None
 
-    def _match_electric_device(self, entity_id, device_class, friendly_name, matched_devices):
-        # 保持电气设备匹配逻辑不变
-        entity_type = entity_id.split('.')[0]
-        entity_core = entity_id.split('.', 1)[1]
-        self.logger.debug(f"处理电气设备实体: {entity_id}（类型: {entity_type}）")
+    def _match_electric_device(self, entity_ctx: EntityContext, candidates: DeviceItems) -> Optional[str]:
+        """匹配电气设备实体，返回新增了属性的设备ID（无新增返回None）"""
+        entity_id, entity_type, entity_core, device_class, friendly_name = entity_ctx
+        if self._debug_enabled:
+            self.logger.debug("处理电气设备实体: %s（类型: %s）", entity_id, entity_type)
 
-        for device_id, device_data in matched_devices.items():
-            device = device_data["config"]
-            if device["type"] not in self.electric_device_types:
+        # 去掉"_p"参数后缀只取决于实体本身，每个实体只做一次
+        stripped_core = _P_SUFFIX_RE.sub('', entity_core) if '_p' in entity_core else entity_core
+
+        for device_id, device_data in candidates:
+            if not device_data.electric:
                 continue
             
-            prefix = device_data["cleaned_prefix"]
-            if prefix not in entity_core:
+            prefix = device_data.cleaned_prefix
+            if not entity_core.startswith(prefix):
                 continue
 
-            if entity_type not in ("sensor", "switch"):
-                continue
-
-            cleaned_suffix = re.sub(r'_p[_\d]+$', '', entity_core)
-            cleaned_suffix = cleaned_suffix.replace(prefix, "").strip('_')
-            self.logger.debug(f"电气设备实体清洗: {entity_core} → {cleaned_suffix}")
-
-            property_name = None
-            if "electric_power" in cleaned_suffix:
-                property_name = "active_power"
-            elif "power_consumption" in cleaned_suffix:
-                property_name = "energy"
-            elif cleaned_suffix in PROPERTY_MAPPING:
-                property_name = PROPERTY_MAPPING[cleaned_suffix]
+            # 前缀与"_p"后缀重叠时去后缀后已不含前缀，此时保留去后缀的核心
+            if stripped_core.startswith(prefix):
+                cleaned_suffix = stripped_core[len(prefix):].strip('_')
             else:
-                for part in cleaned_suffix.split('_'):
-                    if part in PROPERTY_MAPPING:
-                        property_name = PROPERTY_MAPPING[part]
-                        break
-
-            if property_name and property_name in device["supported_properties"]:
-                if property_name not in device_data["entities"]:
-                    device_data["entities"][property_name] = entity_id
+                cleaned_suffix = stripped_core.strip('_')
+            if self._debug_enabled:
+                self.logger.debug("电气设备实体清洗: %s → %s", entity_core, cleaned_suffix)
+
+            property_name = _resolve_property(cleaned_suffix, electric=True)
+
+            if property_name and property_name in device_data.supported:
+                if device_data.entities.setdefault(property_name, entity_id) is entity_id:
                     self.logger.info(f"电气设备匹配成功: {entity_id} → {property_name}（设备: {device_id}）")
-                break
+                    return device_id
+                return None
+        return None
+
+    def fetch_states(self, entity_ids=None) -> Optional[Dict[str, str]]:
+        """一次请求/api/states批量获取实体状态，返回{entity_id: state}（指定entity_ids时只保留这些实体），失败返回None"""
+        try:
+            resp = self._session.get(f"{self.ha_url}/api/states", timeout=10)
+            if resp.status_code != 200:
+                self.logger.error(f"批量获取实体状态失败，状态码: {resp.status_code}")
+                return None
+            states = {}
+            for entity in _json_loads(resp.content):
+                entity_id = entity.get("entity_id", "")
+                if entity_ids is None or entity_id in entity_ids:
+                    states[entity_id] = entity.get("state")
+            return states
+        except Exception as e:
+            self.logger.error(f"批量获取实体状态失败: {e}")
+            return None
 
     def discover(self) -> Dict:
         self.logger.info("开始设备发现...")
         if not self.load_ha_entities():
             return {}
+        if self._last_matched is not None and self._entities_key == self._last_entities_key:
+            self.logger.info(f"HA实体未变化，复用上次匹配结果（{len(self._last_matched)} 个设备）")
+            return self._last_matched
         matched_devices = self.match_entities_to_devices()
+        self._last_entities_key = self._entities_key
+        self._last_matched = matched_devices
         self.logger.info(f"设备发现完成，共匹配 {len(matched_devices)} 个设备")
         return matched_devices
     
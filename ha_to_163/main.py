@@ -1,11 +1,15 @@
 import logging
 import time
 import json
+import math
+import re
 import signal
-import requests
 from utils.config_loader import ConfigLoader
 from utils.mqtt_client import MQTTClient
-from device_discovery.ha_discovery import HADiscovery
+from device_discovery.ha_discovery import HADiscovery, build_ha_session
+
+# 从带单位等非纯数字状态中提取数值
+_NUM_RE = re.compile(r'[-+]?\d*\.\d+|\d+')
 
 
 class HAto163Gateway:
@@ -21,6 +25,12 @@ class HAto163Gateway:
             "Content-Type": "application/json"
         }
 
+        # 就绪探测与逐实体读取使用keep-alive会话但不重试：失败立即返回，由各自的轮询间隔控制节奏
+        self.session = build_ha_session(self.config, self.ha_headers, retries=False)
+
+        # 设备发现器（跨多次发现复用，保留自带重试的HTTP会话与实体缓存，批量获取状态也经由它）
+        self.discovery = HADiscovery(self.config, self.ha_headers)
+
         # 设备与MQTT客户端
         self.matched_devices = {}
         self.mqtt_client = MQTTClient(self.config)
@@ -42,9 +52,8 @@ class HAto163Gateway:
         start_time = time.time()
         while time.time() - start_time < timeout:
             try:
-                resp = requests.get(
+                resp = self.session.get(
                     f"{self.config['ha_url']}/api/",
-                    headers=self.ha_headers,
                     timeout=10
                 )
                 if resp.status_code == 200:
@@ -59,19 +68,24 @@ class HAto163Gateway:
 
     def _discover_devices(self) -> bool:
         """执行设备发现"""
-        discovery = HADiscovery(self.config, self.ha_headers)
-        self.matched_devices = discovery.discover()
+        self.matched_devices = self.discovery.discover()
         return len(self.matched_devices) > 0
 
-    def _get_entity_value(self, entity_id: str, device_type: str) -> float or int or None:
-        """获取HA实体值"""
+    def _get_entity_value(self, entity_id: str, device_type: str, states: dict = None) -> float or int or None:
+        """获取HA实体值（传入本轮批量获取的states时直接取值，否则单独请求该实体）"""
+        if states is not None:
+            state = states.get(entity_id)
+            if state in (None, "unknown", "unavailable", ""):
+                self.logger.warning(f"实体 {entity_id} 暂无有效状态: {state}")
+                return None
+            return self._parse_entity_state(entity_id, state, device_type)
+
         try:
             timeout = self.config.get("entity_ready_timeout", 600)
             start_time = time.time()
             while time.time() - start_time < timeout:
-                resp = requests.get(
+                resp = self.session.get(
                     f"{self.config['ha_url']}/api/states/{entity_id}",
-                    headers=self.ha_headers,
                     timeout=5
                 )
                 if resp.status_code == 200:
@@ -79,24 +93,7 @@ class HAto163Gateway:
                     if state in ("unknown", "unavailable", ""):
                         time.sleep(5)
                         continue
-
-                    # 处理开关状态
-                    if device_type in ("switch", "socket", "breaker"):
-                        if state == "on":
-                            return 1
-                        elif state == "off":
-                            return 0
-                        elif state == "trip" and device_type == "breaker":
-                            return 2
-
-                    # 提取数值
-                    import re
-                    match = re.search(r'[-+]?\d*\.\d+|\d+', state)
-                    if match:
-                        return float(match.group())
-
-                    self.logger.warning(f"实体 {entity_id} 状态无法转换: {state}")
-                    return None
+                    return self._parse_entity_state(entity_id, state, device_type)
 
                 time.sleep(5)
 
@@ -106,6 +103,31 @@ class HAto163Gateway:
             self.logger.error(f"获取实体 {entity_id} 失败: {e}")
             return None
 
+    def _parse_entity_state(self, entity_id: str, state: str, device_type: str) -> float or int or None:
+        """将HA实体状态转换为上报值"""
+        # 处理开关状态
+        if device_type in ("switch", "socket", "breaker"):
+            if state == "on":
+                return 1
+            elif state == "off":
+                return 0
+            elif state == "trip" and device_type == "breaker":
+                return 2
+
+        # 提取数值：纯数字状态（最常见）直接由float()解析，带单位等情况再用正则提取
+        try:
+            value = float(state)
+        except ValueError:
+            value = None
+        if value is not None and math.isfinite(value):
+            return value
+        match = _NUM_RE.search(state)
+        if match:
+            return float(match.group())
+
+        self.logger.warning(f"实体 {entity_id} 状态无法转换: {state}")
+        return None
+
     def _parse_conversion_factors(self, factors_str: str) -> dict:
         """将字符串转换为转换系数字典"""
         if not factors_str:
@@ -116,17 +138,17 @@ class HAto163Gateway:
             self.logger.error(f"转换系数格式错误: {factors_str}，使用默认系数")
             return {}
 
-    def _collect_device_data(self, device_id: str) -> dict:
+    def _collect_device_data(self, device_id: str, states: dict = None) -> dict:
         """收集设备数据（排除state字段的转换）"""
         device_data = self.matched_devices[device_id]
-        device_config = device_data["config"]
+        device_config = device_data.config
         device_type = device_config["type"]
-        entities = device_data["entities"]
+        entities = device_data.entities
         
         # 解析转换系数（从字符串转为字典）
         factors_str = device_config.get("conversion_factors", "")
         conversion_factors = self._parse_conversion_factors(factors_str)
-        self.logger.debug(f"设备 {device_id} 转换系数: {conversion_factors}")
+        self.logger.debug("设备 %s 转换系数: %s", device_id, conversion_factors)
 
         payload = {
             "id": int(time.time() * 1000),
@@ -135,7 +157,7 @@ class HAto163Gateway:
         }
 
         for prop, entity_id in entities.items():
-            value = self._get_entity_value(entity_id, device_type)
+            value = self._get_entity_value(entity_id, device_type, states)
             if value is not None:
                 # state字段不应用转换系数
                 if prop == "state":
@@ -162,12 +184,12 @@ class HAto163Gateway:
 
         return payload
 
-    def _push_device_data(self, device_id: str) -> bool:
+    def _push_device_data(self, device_id: str, states: dict = None) -> bool:
         """推送设备数据到网易IoT平台"""
         device_data = self.matched_devices[device_id]
-        device_config = device_data["config"]
+        device_config = device_data.config
 
-        payload = self._collect_device_data(device_id)
+        payload = self._collect_device_data(device_id, states)
         if not payload["params"]:
             self.logger.warning(f"设备 {device_id} 无有效数据，跳过推送")
             return False
@@ -218,9 +240,16 @@ class HAto163Gateway:
             # 定时推送数据
             if now - last_push >= push_interval:
                 self.logger.info("开始数据推送...")
+                # 每轮只请求一次/api/states取得所有已匹配实体的状态，失败时回退为逐个实体请求
+                entity_ids = {
+                    entity_id
+                    for device_data in self.matched_devices.values()
+                    for entity_id in device_data.entities.values()
+                }
+                states = self.discovery.fetch_states(entity_ids)
                 for device_id in self.matched_devices:
                     self.logger.info(f"\n推送设备 {device_id} 数据")
-                    self._push_device_data(device_id)
+                    self._push_device_data(device_id, states)
                 last_push = now
 
             time.sleep(1)
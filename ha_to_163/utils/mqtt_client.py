@@ -56,7 +56,7 @@ class MQTTClient:
             
             timestamp = int(time.time())
             counter = timestamp // 300  # 每5分钟更新一次计数器
-            self.logger.debug(f"当前counter: {counter}（时间戳: {timestamp}）")
+            self.logger.debug("当前counter: %s（时间戳: %s）", counter, timestamp)
             
             counter_bytes = str(counter).encode('utf-8')
             secret_bytes = device_secret.encode('utf-8')